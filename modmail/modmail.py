@@ -5,16 +5,72 @@ from redbot.core.utils.chat_formatting import box, humanize_timedelta
 from redbot.core.utils.predicates import MessagePredicate
 from redbot.core.utils.menus import menu, DEFAULT_CONTROLS
 from redbot.core.bot import Red
-from datetime import datetime, timedelta
+from datetime import datetime, timezone
 import asyncio
+import itertools
 import logging
-import uuid
-from typing import Optional, Dict, List, Union
+import re
+import time
+from collections import OrderedDict, deque
+from typing import Optional, Dict, List, Tuple, Union
 from abc import ABC, abstractmethod
 import json
 
+try:
+    from redis import asyncio as aioredis
+except ImportError:
+    aioredis = None
+
 log = logging.getLogger("red.cog.modmail")
 
+IMG_EXTS = frozenset({"png", "jpg", "jpeg", "gif", "webp"})
+RATE_LIMIT_MAX_KEYS = 100_000
+RATE_LIMIT_TTL = 600  # Minimum seconds of inactivity before a rate-limit entry is evicted
+REDIS_TIMEOUT = 1.0  # Seconds before a Redis call gives up and falls back to memory
+REDIS_BACKOFF = 30  # Seconds to skip Redis after a failed call
+REUPLOAD_MAX_BYTES = 512 * 1024  # Non-image attachments up to this size are re-uploaded; larger ones stay linked in the embed
+_CLOSE_REACTIONS = frozenset(("✅", "❌"))
+
+# Sliding-window check; like the in-memory path, rejected messages are not recorded
+_RATE_LIMIT_LUA = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], 0, ARGV[1] - ARGV[2])
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[3]) then
+    return 1
+end
+redis.call('ZADD', KEYS[1], ARGV[1], ARGV[1])
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 0
+"""
+
+# Embed colors
+_COLOR_INFO = 0x3498db
+_COLOR_ERR = 0xff6b6b
+_COLOR_OK = 0x00ff00
+_COLOR_WARN = 0xff9900
+
+def _log_task_exc(task: asyncio.Task):
+    """Log the exception of a failed background task"""
+    if not task.cancelled() and task.exception() is not None:
+        log.error("Error in modmail background task", exc_info=task.exception())
+
+def _iso_to_ts(value: str) -> int:
+    """Convert a stored (naive UTC) ISO timestamp to unix seconds"""
+    dt = datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return int(dt.timestamp())
+
+# Hooks declared on ModmailExtension, and optional hooks extensions may implement
+_HOOK_METHODS = (
+    ("thread_created", "on_thread_created"),
+    ("message_processed", "on_message_processed"),
+    ("thread_closed", "on_thread_closed")
+)
+_OPTIONAL_HOOK_METHODS = (
+    ("user_blocked", "on_user_blocked"),
+    ("snippet_used", "on_snippet_used")
+)
+
 class ModmailExtension(ABC):
     """Interface for modmail extensions/plugins"""
     
@@ -52,6 +108,8 @@ class ModMail(commands.Cog):
     __version__ = "2.0.0"
     __author__ = "Advanced Modmail Team"
     
+    _SNIPPET_VAR_RE = re.compile(r"\{(user|username|server|staff)\}")
+    
     def __init__(self, bot: Red):
         self.bot = bot
         self.config = Config.get_conf(self, identifier=1234567890123456, force_registration=True)
@@ -67,11 +125,33 @@ class ModMail(commands.Cog):
         }
         
         # Background tasks
-        self.background_tasks = []
+        self.background_tasks = set()
+        self._background_semaphore = asyncio.Semaphore(16)
         self._cleanup_lock = asyncio.Lock()
         
+        # Channel ID -> thread ID index cache, and channels of open threads
+        self._channel_threads: Dict[int, str] = {}
+        self._modmail_channel_ids: set = set()
+        
+        # Thread ID sequence (seeded from config on load)
+        self._thread_seq = itertools.count()
+        
         # Rate limiting
-        self.rate_limits = {}
+        self.rate_limits: "OrderedDict[str, deque]" = OrderedDict()
+        self._rate_limit_ttl = RATE_LIMIT_TTL  # Grows to the largest time_window seen
+        self.redis = None
+        self._redis_retry_at = 0.0  # Monotonic time before which Redis is skipped after a failure
+        
+        # Guild config cache
+        self._guild_cfg_cache: Dict[int, dict] = {}
+        self._guild_cfg_dirty: set = set()
+        self._staff_role_ids: Dict[int, frozenset] = {}
+        self._enabled_guilds: set = set()
+        
+        # Block caches
+        self._global_blocks: set = set()
+        self._guild_blocks: Dict[int, set] = {}
+        self._user_blocks: set = set()
         
         # Initialize config structure
         self._init_config()
@@ -92,7 +172,7 @@ class ModMail(commands.Cog):
                 "embed": {
                     "enabled": False,
                     "title": "Modmail Received",
-                    "color": 0x3498db,
+                    "color": _COLOR_INFO,
                     "footer": "Response time: Usually within 24 hours"
                 }
             },
@@ -139,7 +219,9 @@ class ModMail(commands.Cog):
             "channel_id": None,
             "guild_id": None,
             "created_at": None,
+            "created_at_ts": None,
             "closed_at": None,
+            "closed_at_ts": None,
             "status": "open",  # open, closed, archived
             "priority": "normal",
             "category": "general",
@@ -161,8 +243,10 @@ class ModMail(commands.Cog):
         default_global = {
             "globally_blocked_users": {},
             "total_threads_created": 0,
+            "next_thread_seq": 0,
             "extensions_enabled": [],
-            "migration_version": "2.0.0"
+            "migration_version": "2.0.0",
+            "channel_index_built": False
         }
         
         self.config.register_guild(**default_guild)
@@ -173,10 +257,14 @@ class ModMail(commands.Cog):
         self.config.init_custom("Thread", 2)  # (guild_id, thread_id)
         self.config.init_custom("ThreadMessages", 3)  # (guild_id, thread_id, page)
         self.config.init_custom("UserConversations", 2)  # (guild_id, user_id)
+        self.config.init_custom("ChannelThread", 2)  # (guild_id, channel_id)
+        self.config.init_custom("Snippet", 2)  # (guild_id, name)
         
         self.config.register_custom("Thread", **default_thread)
         self.config.register_custom("ThreadMessages", messages=[], page_size=50, created_at=None)
-        self.config.register_custom("UserConversations", thread_history=[], active_thread=None)
+        self.config.register_custom("UserConversations", thread_history=[], active_thread=None, active_thread_id=None)
+        self.config.register_custom("ChannelThread", thread_id=None)
+        self.config.register_custom("Snippet", content="", created_by=0, created_at="", usage_count=0)
         
     async def cog_load(self):
         """Initialize async resources and background tasks"""
@@ -185,9 +273,35 @@ class ModMail(commands.Cog):
         # Register modlog case types
         await self._register_modlog_cases()
         
+        # Build in-memory guild state
+        all_guilds = await self.config.all_guilds()
+        self._enabled_guilds = {gid for gid, c in all_guilds.items() if c.get("enabled")}
+        self._guild_blocks = {gid: set(c.get("blocked_users", [])) for gid, c in all_guilds.items()}
+        self._global_blocks = set(map(int, (await self.config.globally_blocked_users()).keys()))
+        all_users = await self.config.all_users()
+        self._user_blocks = {uid for uid, d in all_users.items() if d.get("blocked")}
+        self._thread_seq = itertools.count(await self.config.next_thread_seq())
+        await self._migrate_snippets(all_guilds)
+        
+        all_threads = await self.config.custom("Thread").all()
+        self._modmail_channel_ids = {
+            data["channel_id"]
+            for threads in all_threads.values()
+            for data in threads.values()
+            if data.get("status") == "open" and data.get("channel_id")
+        }
+        if not await self.config.channel_index_built():
+            await self._build_channel_index(all_threads)
+            
+        # Shared rate limit store, if configured via `[p]set api redis url,<url>`
+        try:
+            tokens = await self.bot.get_shared_api_tokens("redis")
+            await self._connect_redis(tokens.get("url"))
+        except Exception as e:
+            log.error(f"Failed to connect to Redis, using in-memory rate limits: {e}")
+        
         # Start background tasks
         self.cleanup_task.start()
-        self.rate_limit_cleanup.start()
         
         # Load extensions
         await self._load_extensions()
@@ -201,17 +315,35 @@ class ModMail(commands.Cog):
         async with self._cleanup_lock:
             # Cancel background tasks
             self.cleanup_task.cancel()
-            self.rate_limit_cleanup.cancel()
             
-            for task in self.background_tasks:
+            # Cancel everything before waiting so one failure can't skip the rest
+            tasks = list(self.background_tasks)
+            for task in tasks:
                 task.cancel()
-                try:
-                    await task
-                except asyncio.CancelledError:
-                    pass
+            await asyncio.gather(*tasks, return_exceptions=True)
+            
+            await self._connect_redis(None)
                     
         log.info("Advanced Modmail System unloaded")
         
+    def _create_background_task(self, coro, delay: float = 0) -> asyncio.Task:
+        """Run a side effect without blocking the caller, tracked for unload"""
+        task = asyncio.create_task(self._run_limited(coro, delay))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        task.add_done_callback(_log_task_exc)
+        # A task cancelled before it starts never awaits coro; close it so it isn't leaked
+        task.add_done_callback(lambda _: coro.close())
+        return task
+        
+    async def _run_limited(self, coro, delay: float = 0):
+        """Await a background coroutine under the concurrency cap"""
+        # Wait before taking a slot so delayed tasks don't hold up others
+        if delay:
+            await asyncio.sleep(delay)
+        async with self._background_semaphore:
+            return await coro
+        
     async def _register_modlog_cases(self):
         """Register custom modlog case types"""
         cases = [
@@ -263,10 +395,13 @@ class ModMail(commands.Cog):
         self.extensions[name] = extension
         
         # Auto-register hooks
-        for hook_name in self.hooks:
-            method_name = f"on_{hook_name}"
-            if hasattr(extension, method_name):
-                self.hooks[hook_name].append(getattr(extension, method_name))
+        for hook_name, method_name in _HOOK_METHODS:
+            self.hooks[hook_name].append(getattr(extension, method_name))
+            
+        for hook_name, method_name in _OPTIONAL_HOOK_METHODS:
+            hook_method = getattr(extension, method_name, None)
+            if hook_method is not None:
+                self.hooks[hook_name].append(hook_method)
                 
         log.info(f"Registered modmail extension: {name}")
         
@@ -276,68 +411,148 @@ class ModMail(commands.Cog):
             extension = self.extensions.pop(name)
             
             # Remove hooks
-            for hook_name in self.hooks:
-                method_name = f"on_{hook_name}"
-                if hasattr(extension, method_name):
-                    hook_method = getattr(extension, method_name)
-                    if hook_method in self.hooks[hook_name]:
-                        self.hooks[hook_name].remove(hook_method)
+            for hook_name, method_name in _HOOK_METHODS + _OPTIONAL_HOOK_METHODS:
+                hook_method = getattr(extension, method_name, None)
+                if hook_method in self.hooks[hook_name]:
+                    self.hooks[hook_name].remove(hook_method)
                         
             log.info(f"Unregistered modmail extension: {name}")
             
     async def _trigger_hook(self, hook_name: str, *args, **kwargs):
         """Trigger extension hooks"""
-        for hook in self.hooks.get(hook_name, []):
+        hooks = self.hooks.get(hook_name, [])
+        if not hooks:
+            return
+            
+        async def _run_hook(hook):
+            return await hook(*args, **kwargs)
+            
+        results = await asyncio.gather(*(_run_hook(hook) for hook in hooks), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.error(f"Error in extension hook {hook_name}: {result}")
+                
+    # Guild Config Cache
+    async def _get_guild_cfg(self, guild_id: int) -> dict:
+        """Get guild config, served from cache unless invalidated"""
+        if guild_id in self._guild_cfg_dirty or guild_id not in self._guild_cfg_cache:
+            self._guild_cfg_dirty.discard(guild_id)
+            self._store_guild_cfg(guild_id, await self.config.guild_from_id(guild_id).all())
+        return self._guild_cfg_cache[guild_id]
+        
+    async def _prime_guild_cfgs(self, guild_ids):
+        """Refresh any uncached guild configs with a single bulk read"""
+        missing = [gid for gid in guild_ids if gid in self._guild_cfg_dirty or gid not in self._guild_cfg_cache]
+        if not missing:
+            return
+            
+        all_cfgs = await self.config.all_guilds()
+        for gid in missing:
+            self._guild_cfg_dirty.discard(gid)
+            if gid in all_cfgs:
+                # all_guilds() only fills top-level defaults; merge nested ones to match guild_from_id().all()
+                self._store_guild_cfg(gid, self.config.guild_from_id(gid).nested_update(all_cfgs[gid]))
+            else:
+                self._store_guild_cfg(gid, await self.config.guild_from_id(gid).all())
+                
+    def _store_guild_cfg(self, guild_id: int, cfg: dict):
+        """Cache guild config along with its derived lookup structures"""
+        self._guild_cfg_cache[guild_id] = cfg
+        self._staff_role_ids[guild_id] = frozenset(cfg.get("staff_roles", []))
+        
+    def _mark_guild_dirty(self, guild_id: int):
+        """Invalidate cached guild config after a write"""
+        self._guild_cfg_dirty.add(guild_id)
+        
+    # Rate Limiting System
+    async def _connect_redis(self, url: Optional[str]):
+        """Replace the Redis client used for rate limiting (None disconnects)"""
+        client = None
+        if url:
+            if aioredis is None:
+                log.warning("Redis URL configured but the redis package is not installed; using in-memory rate limits")
+            else:
+                try:
+                    client = aioredis.from_url(url, socket_connect_timeout=REDIS_TIMEOUT, socket_timeout=REDIS_TIMEOUT)
+                except ValueError as e:
+                    log.error(f"Invalid Redis URL, using in-memory rate limits: {e}")
+                    
+        if self.redis is not None:
             try:
-                await hook(*args, **kwargs)
+                # aclose() only exists in redis-py >= 5.0.1
+                close = getattr(self.redis, "aclose", None) or self.redis.close
+                await close()
             except Exception as e:
-                log.error(f"Error in extension hook {hook_name}: {e}")
+                log.error(f"Error closing Redis connection: {e}")
                 
-    # Rate Limiting System
-    async def _is_rate_limited(self, user_id: int, guild_id: int) -> bool:
-        """Check if user is rate limited"""
-        guild_config = await self.config.guild_from_id(guild_id).all()
-        rate_config = guild_config.get("rate_limiting", {})
+        self.redis = client
+        self._redis_retry_at = 0.0
         
+    @commands.Cog.listener()
+    async def on_red_api_tokens_update(self, service_name: str, api_tokens: Dict[str, str]):
+        """Reconnect Redis when its shared API token is changed"""
+        if service_name == "redis":
+            await self._connect_redis(api_tokens.get("url"))
+            
+    async def _is_rate_limited(self, user_id: int, guild_id: int, rate_config: dict) -> bool:
+        """Check if user is rate limited"""
         if not rate_config.get("enabled", True):
             return False
             
+        if self.redis is not None and time.monotonic() >= self._redis_retry_at:
+            try:
+                limited = await self._is_rate_limited_redis(user_id, guild_id, rate_config)
+            except Exception as e:
+                # Back off instead of waiting on an unreachable server for every DM
+                self._redis_retry_at = time.monotonic() + REDIS_BACKOFF
+                log.error(f"Redis rate limit check failed, using in-memory rate limits for {REDIS_BACKOFF}s: {e}")
+            else:
+                return limited
+                
         key = f"{guild_id}:{user_id}"
-        now = datetime.utcnow()
-        
-        if key not in self.rate_limits:
-            self.rate_limits[key] = []
+        now = time.monotonic()
+        time_window = rate_config.get("time_window", 300)
+        # Never evict entries that are still inside the longest configured window
+        if time_window > self._rate_limit_ttl:
+            self._rate_limit_ttl = time_window
+        self._evict_rate_limits(now)
+        
+        timestamps = self.rate_limits.get(key)
+        if timestamps is None:
+            timestamps = self.rate_limits[key] = deque()
+        else:
+            self.rate_limits.move_to_end(key)
             
         # Clean old entries
-        time_window = rate_config.get("time_window", 300)
-        cutoff = now - timedelta(seconds=time_window)
-        self.rate_limits[key] = [timestamp for timestamp in self.rate_limits[key] if timestamp > cutoff]
+        cutoff = now - time_window
+        while timestamps and timestamps[0] <= cutoff:
+            timestamps.popleft()
         
         # Check rate limit
         max_messages = rate_config.get("max_messages", 5)
-        if len(self.rate_limits[key]) >= max_messages:
+        if len(timestamps) >= max_messages:
             return True
             
         # Add current timestamp
-        self.rate_limits[key].append(now)
+        timestamps.append(now)
         return False
         
-    @tasks.loop(minutes=5)
-    async def rate_limit_cleanup(self):
-        """Clean up old rate limit entries"""
-        now = datetime.utcnow()
-        cutoff = now - timedelta(minutes=10)
-        
-        keys_to_remove = []
-        for key, timestamps in self.rate_limits.items():
-            # Filter out old timestamps
-            self.rate_limits[key] = [ts for ts in timestamps if ts > cutoff]
-            
-            # Remove empty entries
-            if not self.rate_limits[key]:
-                keys_to_remove.append(key)
-                
-        for key in keys_to_remove:
+    async def _is_rate_limited_redis(self, user_id: int, guild_id: int, rate_config: dict) -> bool:
+        """Sliding-window rate limit check backed by a Redis sorted set"""
+        key = f"modmail:ratelimit:{guild_id}:{user_id}"
+        limited = await self.redis.eval(
+            _RATE_LIMIT_LUA, 1, key,
+            time.time(), rate_config.get("time_window", 300), rate_config.get("max_messages", 5)
+        )
+        return bool(limited)
+        
+    def _evict_rate_limits(self, now: float):
+        """Evict least recently used rate limit entries that are stale or over capacity"""
+        cutoff = now - self._rate_limit_ttl
+        while self.rate_limits:
+            key, timestamps = next(iter(self.rate_limits.items()))
+            if len(self.rate_limits) <= RATE_LIMIT_MAX_KEYS and timestamps and timestamps[-1] > cutoff:
+                break
             del self.rate_limits[key]
             
     # Message Processing
@@ -353,28 +568,35 @@ class ModMail(commands.Cog):
             
         # Find all guilds where modmail is enabled and user has access
         eligible_guilds = []
+        # Snapshot: settings commands can change the set while this loop awaits
+        enabled_guilds = tuple(self._enabled_guilds)
+        await self._prime_guild_cfgs(enabled_guilds)
         
-        for guild in self.bot.guilds:
-            config = await self.config.guild(guild).all()
+        for guild_id in enabled_guilds:
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue
+                
+            config = await self._get_guild_cfg(guild_id)
             if not config.get("enabled", False):
                 continue
                 
             # Check if user meets requirements
             if await self._check_user_requirements(message.author, guild, config):
-                eligible_guilds.append(guild)
+                eligible_guilds.append((guild, config))
                 
         if not eligible_guilds:
             return
             
         # If multiple guilds, let user choose (for now, use first eligible)
-        target_guild = eligible_guilds[0]
+        target_guild, target_config = eligible_guilds[0]
         
         # Check blocks and rate limits
         if await self._is_user_blocked(message.author.id, target_guild.id):
             return
             
-        if await self._is_rate_limited(message.author.id, target_guild.id):
-            rate_config = await self.config.guild(target_guild).rate_limiting()
+        rate_config = target_config.get("rate_limiting", {})
+        if await self._is_rate_limited(message.author.id, target_guild.id, rate_config):
             await message.author.send(rate_config.get("cooldown_message", "You're sending messages too quickly."))
             return
             
@@ -388,11 +610,12 @@ class ModMail(commands.Cog):
     async def _check_user_requirements(self, user: discord.User, guild: discord.Guild, config: dict) -> bool:
         """Check if user meets requirements to use modmail"""
         requirements = config.get("user_requirements", {})
+        now = time.time()
         
         # Check account age
         min_age = requirements.get("min_account_age", 0)
         if min_age > 0:
-            account_age = (discord.utils.utcnow() - user.created_at).total_seconds()
+            account_age = now - user.created_at.timestamp()
             if account_age < min_age:
                 return False
                 
@@ -405,7 +628,7 @@ class ModMail(commands.Cog):
             # Check server join age
             min_server_age = requirements.get("min_server_age", 0)
             if min_server_age > 0:
-                join_age = (discord.utils.utcnow() - member.joined_at).total_seconds()
+                join_age = now - member.joined_at.timestamp()
                 if join_age < min_server_age:
                     return False
                     
@@ -414,48 +637,38 @@ class ModMail(commands.Cog):
     async def _is_user_blocked(self, user_id: int, guild_id: int = None) -> bool:
         """Check if user is blocked from modmail"""
         # Check global blocks
-        global_blocks = await self.config.globally_blocked_users()
-        if str(user_id) in global_blocks:
+        if user_id in self._global_blocks:
             return True
             
         # Check user-specific block
-        user_data = await self.config.user_from_id(user_id).all()
-        if user_data.get("blocked", False):
+        if user_id in self._user_blocks:
             return True
             
         # Check guild-specific blocks
-        if guild_id:
-            guild_blocks = await self.config.guild_from_id(guild_id).blocked_users()
-            if user_id in guild_blocks:
-                return True
+        if guild_id and user_id in self._guild_blocks.get(guild_id, ()):
+            return True
                 
         return False
         
     async def _process_modmail_message(self, message: discord.Message, guild: discord.Guild):
         """Process incoming modmail message"""
         # Get or create thread
-        thread_channel = await self._get_or_create_thread(message.author, guild)
-        if not thread_channel:
+        thread = await self._get_or_create_thread(message.author, guild)
+        if not thread:
             await message.author.send("Unable to create modmail thread. Please contact an administrator.")
             return
             
-        # Get thread data
-        thread_id = self._get_thread_id(message.author.id, guild.id)
-        thread_data = await self.config.custom("Thread", guild.id, thread_id).all()
+        thread_channel, thread_id = thread
         
-        # Create user info embed
-        user_embed = await self._create_user_info_embed(message.author, guild)
+        # Bump message count; user info is only shown on the first message
+        first_message = await self._increment_message_count(thread_id, guild.id)
+        user_embed = await self._create_user_info_embed(message.author, guild) if first_message else None
         
         # Forward message to thread
         await self._forward_message_to_thread(message, thread_channel, user_embed)
         
-        # Update thread data
-        await self._update_thread_data(thread_id, guild.id, {
-            "message_count": thread_data["message_count"] + 1
-        })
-        
         # Send auto-response if this is the first message
-        if thread_data["message_count"] == 0:
+        if first_message:
             await self._send_auto_response(message.author, guild)
             
         # Trigger extension hooks
@@ -467,33 +680,68 @@ class ModMail(commands.Cog):
             "attachments": [att.url for att in message.attachments],
             "timestamp": message.created_at
         }
-        await self._trigger_hook("message_processed", message_data)
+        self._create_background_task(self._trigger_hook("message_processed", message_data))
         
         # Log to modlog if first message in thread
-        if thread_data["message_count"] == 0:
-            await self._log_thread_created(message.author, guild, thread_channel)
+        if first_message:
+            self._create_background_task(self._log_thread_created(message.author, guild, thread_channel))
             
-    async def _get_or_create_thread(self, user: discord.User, guild: discord.Guild) -> Optional[discord.TextChannel]:
-        """Get existing thread or create new one"""
-        thread_id = self._get_thread_id(user.id, guild.id)
-        
+    async def _get_or_create_thread(self, user: discord.User, guild: discord.Guild) -> Optional[Tuple[discord.TextChannel, str]]:
+        """Get existing thread or create new one, returning its channel and thread ID"""
         # Check for existing active thread
-        existing_thread = await self.config.custom("UserConversations", guild.id, user.id).active_thread()
-        if existing_thread:
-            channel = guild.get_channel(existing_thread)
+        conversation = await self.config.custom("UserConversations", guild.id, user.id).all()
+        if conversation["active_thread"]:
+            channel = guild.get_channel(conversation["active_thread"])
             if channel:
-                return channel
-                
+                thread_id = conversation["active_thread_id"] or await self._find_thread_id(guild.id, channel.id)
+                if thread_id:
+                    return channel, thread_id
+                    
         # Create new thread
-        return await self._create_new_thread(user, guild, thread_id)
+        thread_id = self._get_thread_id()
+        await self.config.next_thread_seq.set(int(thread_id) + 1)
+        channel = await self._create_new_thread(user, guild, thread_id)
+        if not channel:
+            return None
+        return channel, thread_id
+        
+    async def _find_thread_id(self, guild_id: int, channel_id: int) -> Optional[str]:
+        """Find the thread ID stored for a channel"""
+        thread_id = self._channel_threads.get(channel_id)
+        if thread_id is None:
+            thread_id = await self.config.custom("ChannelThread", guild_id, channel_id).thread_id()
+            if thread_id is not None:
+                self._channel_threads[channel_id] = thread_id
+        return thread_id
+        
+    async def _migrate_snippets(self, all_guilds: dict):
+        """Move snippets stored on guild config into the per-snippet custom group"""
+        for guild_id, guild_config in all_guilds.items():
+            snippets = guild_config.get("snippets")
+            if not snippets:
+                continue
+                
+            for name, data in snippets.items():
+                await self.config.custom("Snippet", guild_id, name).set(data)
+            await self.config.guild_from_id(guild_id).snippets.clear()
+            self._mark_guild_dirty(guild_id)
+            
+    async def _build_channel_index(self, all_threads: dict):
+        """Backfill the channel -> thread index for threads created before it existed"""
+        for guild_id, threads in all_threads.items():
+            for thread_id, data in threads.items():
+                if data.get("channel_id"):
+                    await self.config.custom("ChannelThread", guild_id, data["channel_id"]).thread_id.set(thread_id)
+                    
+        await self.config.channel_index_built.set(True)
         
-    def _get_thread_id(self, user_id: int, guild_id: int) -> str:
-        """Generate unique thread ID"""
-        return f"{user_id}-{guild_id}-{uuid.uuid4().hex[:8]}"
+    def _get_thread_id(self) -> str:
+        """Take the next thread ID from the global sequence"""
+        return str(next(self._thread_seq))
         
     async def _create_new_thread(self, user: discord.User, guild: discord.Guild, thread_id: str) -> Optional[discord.TextChannel]:
         """Create a new modmail thread channel"""
-        config = await self.config.guild(guild).all()
+        config = await self._get_guild_cfg(guild.id)
         category_id = config.get("category_id")
         
         if not category_id:
@@ -513,11 +761,12 @@ class ModMail(commands.Cog):
                 guild.me: discord.PermissionOverwrite(read_messages=True, send_messages=True, manage_messages=True)
             }
             
-            # Add staff role permissions
-            for role_id in config.get("staff_roles", []):
+            # Add staff role permissions (get_role is a dict lookup in discord.py 2.x)
+            staff_overwrite = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+            for role_id in self._staff_role_ids.get(guild.id, ()):
                 role = guild.get_role(role_id)
                 if role:
-                    overwrites[role] = discord.PermissionOverwrite(read_messages=True, send_messages=True)
+                    overwrites[role] = staff_overwrite
                     
             channel = await category.create_text_channel(
                 name=channel_name,
@@ -526,17 +775,25 @@ class ModMail(commands.Cog):
             )
             
             # Initialize thread data
+            now = datetime.now(timezone.utc)
             thread_data = {
                 "user_id": user.id,
                 "channel_id": channel.id,
                 "guild_id": guild.id,
-                "created_at": datetime.utcnow().isoformat(),
+                "created_at": now.isoformat(),
+                "created_at_ts": int(now.timestamp()),
                 "status": "open",
                 "participants": [user.id]
             }
             
             await self.config.custom("Thread", guild.id, thread_id).set(thread_data)
-            await self.config.custom("UserConversations", guild.id, user.id).active_thread.set(channel.id)
+            await self.config.custom("ChannelThread", guild.id, channel.id).thread_id.set(thread_id)
+            self._channel_threads[channel.id] = thread_id
+            self._modmail_channel_ids.add(channel.id)
+            async with self.config.custom("UserConversations", guild.id, user.id).all() as conversation:
+                conversation["active_thread"] = channel.id
+                conversation["active_thread_id"] = thread_id
+                conversation["thread_history"].append(thread_id)
             
             # Update global counter
             total = await self.config.total_threads_created()
@@ -556,7 +813,7 @@ class ModMail(commands.Cog):
             
     async def _create_user_info_embed(self, user: discord.User, guild: discord.Guild) -> discord.Embed:
         """Create embed with user information"""
-        embed = discord.Embed(title="User Information", color=0x3498db)
+        embed = discord.Embed(title="User Information", color=_COLOR_INFO)
         embed.set_thumbnail(url=user.display_avatar.url)
         
         # Basic info
@@ -566,7 +823,8 @@ class ModMail(commands.Cog):
         # Server member info
         member = guild.get_member(user.id)
         if member:
-            embed.add_field(name="Joined Server", value=f"<t:{int(member.joined_at.timestamp())}:R>", inline=True)
+            if member.joined_at:
+                embed.add_field(name="Joined Server", value=f"<t:{int(member.joined_at.timestamp())}:R>", inline=True)
             if member.roles[1:]:  # Exclude @everyone
                 roles = ", ".join([role.mention for role in member.roles[1:][:5]])
                 if len(member.roles) > 6:
@@ -580,8 +838,7 @@ class ModMail(commands.Cog):
         embed.add_field(name="Previous Threads", value=str(user_data.get("total_threads", 0)), inline=True)
         
         if user_data.get("last_thread_at"):
-            last_thread = datetime.fromisoformat(user_data["last_thread_at"])
-            embed.add_field(name="Last Thread", value=f"<t:{int(last_thread.timestamp())}:R>", inline=True)
+            embed.add_field(name="Last Thread", value=f"<t:{_iso_to_ts(user_data['last_thread_at'])}:R>", inline=True)
             
         return embed
         
@@ -592,30 +849,47 @@ class ModMail(commands.Cog):
             await thread_channel.send(embed=user_embed)
             
         # Create message embed
-        embed = discord.Embed(description=message.content, color=0x3498db, timestamp=message.created_at)
+        embed = discord.Embed(description=message.content, color=_COLOR_INFO, timestamp=message.created_at)
         embed.set_author(name=str(message.author), icon_url=message.author.display_avatar.url)
         
+        images = []
+        non_images = []
+        for att in message.attachments:
+            (images if self._is_image(att) else non_images).append(att)
+        
         if message.attachments:
-            if len(message.attachments) == 1 and message.attachments[0].url.lower().endswith(('png', 'jpg', 'jpeg', 'gif', 'webp')):
-                embed.set_image(url=message.attachments[0].url)
+            if len(message.attachments) == 1 and images:
+                embed.set_image(url=images[0].url)
             else:
                 attachment_list = "\n".join([f"[{att.filename}]({att.url})" for att in message.attachments])
                 embed.add_field(name="Attachments", value=attachment_list, inline=False)
                 
         await thread_channel.send(embed=embed)
         
-        # Forward attachments if they're not images
-        for attachment in message.attachments:
-            if not attachment.url.lower().endswith(('png', 'jpg', 'jpeg', 'gif', 'webp')):
-                try:
-                    file = await attachment.to_file()
-                    await thread_channel.send(file=file)
-                except discord.HTTPException:
-                    pass  # File too large or other error
-                    
+        # Re-upload small non-image attachments so the thread keeps a copy once the DM link expires
+        for attachment in non_images:
+            if attachment.size > REUPLOAD_MAX_BYTES:
+                continue
+            try:
+                file = await attachment.to_file()
+                await thread_channel.send(file=file)
+            except discord.HTTPException:
+                pass  # File too large or other error
+                
+    @staticmethod
+    def _is_image(attachment: discord.Attachment) -> bool:
+        """Check whether an attachment is an image"""
+        content_type = attachment.content_type
+        if content_type:
+            return content_type.startswith("image/")
+            
+        # Untagged attachments fall back to the file extension
+        ext = attachment.filename.rsplit(".", 1)[-1].lower()
+        return ext in IMG_EXTS
+        
     async def _send_auto_response(self, user: discord.User, guild: discord.Guild):
         """Send automatic response to user"""
-        config = await self.config.guild(guild).auto_response()
+        config = (await self._get_guild_cfg(guild.id))["auto_response"]
         
         if not config.get("enabled", True):
             return
@@ -627,7 +901,7 @@ class ModMail(commands.Cog):
             embed = discord.Embed(
                 title=embed_config.get("title", "Modmail Received"),
                 description=message,
-                color=embed_config.get("color", 0x3498db)
+                color=embed_config.get("color", _COLOR_INFO)
             )
             
             footer = embed_config.get("footer")
@@ -638,6 +912,13 @@ class ModMail(commands.Cog):
         else:
             await user.send(message)
             
+    async def _increment_message_count(self, thread_id: str, guild_id: int) -> bool:
+        """Bump thread message count, returning whether this was the first message"""
+        async with self.config.custom("Thread", guild_id, thread_id).all() as thread_data:
+            first_message = thread_data["message_count"] == 0
+            thread_data["message_count"] += 1
+        return first_message
+        
     async def _update_thread_data(self, thread_id: str, guild_id: int, updates: dict):
         """Update thread data"""
         async with self.config.custom("Thread", guild_id, thread_id).all() as thread_data:
@@ -649,7 +930,7 @@ class ModMail(commands.Cog):
             await modlog.create_case(
                 self.bot,
                 guild,
-                datetime.utcnow(),
+                datetime.now(timezone.utc),
                 action_type="modmail_thread_created",
                 user=user,
                 reason=f"Modmail thread created in {channel.mention}"
@@ -672,7 +953,7 @@ class ModMail(commands.Cog):
         def check(m):
             return m.author == ctx.author and m.channel == ctx.channel
             
-        embed = discord.Embed(title="Modmail Setup", description="Let's set up modmail for your server!", color=0x3498db)
+        embed = discord.Embed(title="Modmail Setup", description="Let's set up modmail for your server!", color=_COLOR_INFO)
         await ctx.send(embed=embed)
         
         # Category selection
@@ -697,6 +978,7 @@ class ModMail(commands.Cog):
                 return
                 
             await self.config.guild(ctx.guild).category_id.set(category.id)
+            self._mark_guild_dirty(ctx.guild.id)
             await ctx.send(f"✅ Modmail category set to: {category.name}")
             
         except asyncio.TimeoutError:
@@ -718,8 +1000,9 @@ class ModMail(commands.Cog):
                 await ctx.send("No valid roles found. You can set staff roles later with `modmail settings staff`.")
                 
             await self.config.guild(ctx.guild).staff_roles.set(staff_roles)
+            self._mark_guild_dirty(ctx.guild.id)
             if staff_roles:
-                role_names = [ctx.guild.get_role(role_id).name for role_id in staff_roles]
+                role_names = [role.name for role in msg.role_mentions]
                 await ctx.send(f"✅ Staff roles set to: {', '.join(role_names)}")
             else:
                 await ctx.send("✅ No staff roles set. Only administrators will have access.")
@@ -729,11 +1012,13 @@ class ModMail(commands.Cog):
             
         # Enable modmail
         await self.config.guild(ctx.guild).enabled.set(True)
+        self._mark_guild_dirty(ctx.guild.id)
+        self._enabled_guilds.add(ctx.guild.id)
         
         embed = discord.Embed(
             title="✅ Modmail Setup Complete!",
             description=f"Modmail is now enabled for {ctx.guild.name}.\n\nUsers can now send DMs to the bot to create modmail threads.",
-            color=0x00ff00
+            color=_COLOR_OK
         )
         embed.add_field(name="Next Steps", value="• Configure auto-responses with `modmail settings autoresponse`\n• Add snippets with `modmail snippet add`\n• Set up additional settings with `modmail settings`", inline=False)
         await ctx.send(embed=embed)
@@ -747,9 +1032,9 @@ class ModMail(commands.Cog):
             
     async def _show_settings(self, ctx):
         """Show current modmail settings"""
-        config = await self.config.guild(ctx.guild).all()
+        config = await self._get_guild_cfg(ctx.guild.id)
         
-        embed = discord.Embed(title=f"Modmail Settings - {ctx.guild.name}", color=0x3498db)
+        embed = discord.Embed(title=f"Modmail Settings - {ctx.guild.name}", color=_COLOR_INFO)
         
         # Basic settings
         embed.add_field(name="Status", value="✅ Enabled" if config["enabled"] else "❌ Disabled", inline=True)
@@ -757,7 +1042,7 @@ class ModMail(commands.Cog):
         category = ctx.guild.get_channel(config["category_id"]) if config["category_id"] else None
         embed.add_field(name="Category", value=category.name if category else "Not set", inline=True)
         
-        staff_roles = [ctx.guild.get_role(r_id).name for r_id in config["staff_roles"] if ctx.guild.get_role(r_id)]
+        staff_roles = [r.name for r_id in config["staff_roles"] if (r := ctx.guild.get_role(r_id)) is not None]
         embed.add_field(name="Staff Roles", value=", ".join(staff_roles) if staff_roles else "None", inline=True)
         
         # Auto-response
@@ -792,6 +1077,8 @@ class ModMail(commands.Cog):
     async def settings_enable(self, ctx):
         """Enable modmail system"""
         await self.config.guild(ctx.guild).enabled.set(True)
+        self._mark_guild_dirty(ctx.guild.id)
+        self._enabled_guilds.add(ctx.guild.id)
         await ctx.send("✅ Modmail system enabled.")
         
     @modmail_settings.command(name="disable")
@@ -799,6 +1086,8 @@ class ModMail(commands.Cog):
     async def settings_disable(self, ctx):
         """Disable modmail system"""
         await self.config.guild(ctx.guild).enabled.set(False)
+        self._mark_guild_dirty(ctx.guild.id)
+        self._enabled_guilds.discard(ctx.guild.id)
         await ctx.send("❌ Modmail system disabled.")
         
     @modmail_settings.command(name="category")
@@ -806,6 +1095,7 @@ class ModMail(commands.Cog):
     async def settings_category(self, ctx, category: discord.CategoryChannel):
         """Set the category for modmail threads"""
         await self.config.guild(ctx.guild).category_id.set(category.id)
+        self._mark_guild_dirty(ctx.guild.id)
         await ctx.send(f"✅ Modmail category set to: {category.name}")
         
     @modmail_settings.command(name="staff")
@@ -814,6 +1104,7 @@ class ModMail(commands.Cog):
         """Set staff roles that can access modmail"""
         role_ids = [role.id for role in roles]
         await self.config.guild(ctx.guild).staff_roles.set(role_ids)
+        self._mark_guild_dirty(ctx.guild.id)
         
         if roles:
             role_names = [role.name for role in roles]
@@ -826,6 +1117,7 @@ class ModMail(commands.Cog):
     async def settings_autoclose(self, ctx, time: int):
         """Set auto-close time in seconds (0 to disable)"""
         await self.config.guild(ctx.guild).thread_settings.auto_close_after.set(time)
+        self._mark_guild_dirty(ctx.guild.id)
         
         if time > 0:
             time_str = humanize_timedelta(seconds=time)
@@ -838,7 +1130,7 @@ class ModMail(commands.Cog):
     @checks.mod_or_permissions(manage_messages=True)
     async def modmail_close(self, ctx, *, reason: str = None):
         """Close the current modmail thread"""
-        if not await self._is_modmail_channel(ctx.channel):
+        if not self._is_modmail_channel(ctx.channel):
             await ctx.send("This command can only be used in modmail threads.")
             return
             
@@ -848,7 +1140,7 @@ class ModMail(commands.Cog):
             await ctx.send("Could not find thread data.")
             return
             
-        config = await self.config.guild(ctx.guild).thread_settings()
+        config = (await self._get_guild_cfg(ctx.guild.id))["thread_settings"]
         
         # Require reason if configured
         if config.get("require_close_reason", True) and not reason:
@@ -860,7 +1152,7 @@ class ModMail(commands.Cog):
             embed = discord.Embed(
                 title="Close Thread?",
                 description=f"Are you sure you want to close this modmail thread?\n\n**Reason:** {reason or 'No reason provided'}",
-                color=0xff9900
+                color=_COLOR_WARN
             )
             
             msg = await ctx.send(embed=embed)
@@ -868,12 +1160,12 @@ class ModMail(commands.Cog):
             await msg.add_reaction("❌")
             
             def reaction_check(reaction, user):
-                return user == ctx.author and str(reaction.emoji) in ["✅", "❌"] and reaction.message.id == msg.id
+                return user == ctx.author and reaction.message.id == msg.id and reaction.emoji in _CLOSE_REACTIONS
                 
             try:
                 reaction, user = await self.bot.wait_for("reaction_add", check=reaction_check, timeout=30)
                 
-                if str(reaction.emoji) == "❌":
+                if reaction.emoji == "❌":
                     await ctx.send("Thread close cancelled.")
                     return
                     
@@ -884,70 +1176,64 @@ class ModMail(commands.Cog):
         # Close the thread
         await self._close_thread(ctx.channel, ctx.author, reason, thread_data)
         
-    async def _is_modmail_channel(self, channel: discord.TextChannel) -> bool:
-        """Check if channel is a modmail thread"""
-        # Simple check - could be enhanced to check thread data
-        return channel.name.startswith("modmail-")
+    def _is_modmail_channel(self, channel: discord.TextChannel) -> bool:
+        """Check if channel is an open modmail thread"""
+        return channel.id in self._modmail_channel_ids
         
     async def _get_thread_data_from_channel(self, channel: discord.TextChannel) -> Optional[dict]:
         """Get thread data from channel"""
-        # Search through all threads for this channel
-        all_threads = await self.config.custom("Thread", channel.guild.id).all()
-        
-        for thread_id, data in all_threads.items():
-            if data.get("channel_id") == channel.id:
-                return data
-                
-        return None
+        thread_id = await self._find_thread_id(channel.guild.id, channel.id)
+        if thread_id is None:
+            return None
+            
+        return await self.config.custom("Thread", channel.guild.id, thread_id).all()
         
     async def _close_thread(self, channel: discord.TextChannel, closer: discord.Member, reason: str, thread_data: dict):
         """Close a modmail thread"""
+        now = datetime.now(timezone.utc)
         try:
             # Update thread data
-            thread_id = None
-            all_threads = await self.config.custom("Thread", channel.guild.id).all()
-            for t_id, data in all_threads.items():
-                if data.get("channel_id") == channel.id:
-                    thread_id = t_id
-                    break
-                    
+            thread_id = await self._find_thread_id(channel.guild.id, channel.id)
             if thread_id:
                 updates = {
                     "status": "closed",
-                    "closed_at": datetime.utcnow().isoformat(),
+                    "closed_at": now.isoformat(),
+                    "closed_at_ts": int(now.timestamp()),
                     "close_reason": reason,
                     "closed_by": closer.id
                 }
                 await self._update_thread_data(thread_id, channel.guild.id, updates)
-                
+            self._modmail_channel_ids.discard(channel.id)
+            
+            user_id = thread_data.get("user_id")
+            user = self.bot.get_user(user_id) if user_id else None
+            
             # Notify user if configured
-            config = await self.config.guild(channel.guild).thread_settings()
-            if config.get("notify_user_on_close", True) and thread_data.get("user_id"):
-                user = self.bot.get_user(thread_data["user_id"])
-                if user:
-                    embed = discord.Embed(
-                        title="Thread Closed",
-                        description=f"Your modmail thread in **{channel.guild.name}** has been closed.",
-                        color=0xff6b6b
-                    )
+            config = (await self._get_guild_cfg(channel.guild.id))["thread_settings"]
+            if config.get("notify_user_on_close", True) and user:
+                embed = discord.Embed(
+                    title="Thread Closed",
+                    description=f"Your modmail thread in **{channel.guild.name}** has been closed.",
+                    color=_COLOR_ERR
+                )
+                
+                if reason:
+                    embed.add_field(name="Reason", value=reason, inline=False)
                     
-                    if reason:
-                        embed.add_field(name="Reason", value=reason, inline=False)
-                        
-                    embed.add_field(name="Closed by", value=str(closer), inline=True)
-                    embed.set_footer(text="Thank you for contacting us!")
+                embed.add_field(name="Closed by", value=str(closer), inline=True)
+                embed.set_footer(text="Thank you for contacting us!")
+                
+                try:
+                    await user.send(embed=embed)
+                except discord.Forbidden:
+                    pass  # User has DMs disabled
                     
-                    try:
-                        await user.send(embed=embed)
-                    except discord.Forbidden:
-                        pass  # User has DMs disabled
-                        
             # Send close message in channel
             embed = discord.Embed(
                 title="Thread Closed",
                 description=f"This thread has been closed by {closer.mention}.",
-                color=0xff6b6b,
-                timestamp=datetime.utcnow()
+                color=_COLOR_ERR,
+                timestamp=now
             )
             
             if reason:
@@ -957,48 +1243,63 @@ class ModMail(commands.Cog):
             
             # Clear active thread for user
             if thread_data.get("user_id"):
-                await self.config.custom("UserConversations", channel.guild.id, thread_data["user_id"]).active_thread.set(None)
+                async with self.config.custom("UserConversations", channel.guild.id, thread_data["user_id"]).all() as conversation:
+                    conversation["active_thread"] = None
+                    conversation["active_thread_id"] = None
                 
             # Delete channel if configured
             if config.get("delete_on_close", False):
-                await asyncio.sleep(5)  # Give time to read the message
-                await channel.delete(reason=f"Modmail thread closed by {closer}")
+                # Give time to read the message without holding up the close
+                self._create_background_task(self._delete_closed_channel(channel, closer), delay=5)
             else:
-                # Archive the channel
-                await channel.edit(name=f"closed-{channel.name}")
-                
-                # Remove send permissions for staff
+                # Archive the channel and remove send permissions for staff in one edit
                 overwrites = channel.overwrites
                 for target, overwrite in overwrites.items():
                     if isinstance(target, discord.Role):
                         overwrite.send_messages = False
-                        await channel.set_permissions(target, overwrite=overwrite)
                         
+                await channel.edit(
+                    name=f"closed-{channel.name}",
+                    overwrites=overwrites,
+                    reason=f"Modmail thread closed by {closer}"
+                )
+                
             # Log to modlog
-            await modlog.create_case(
+            self._create_background_task(modlog.create_case(
                 self.bot,
                 channel.guild,
-                datetime.utcnow(),
+                now,
                 action_type="modmail_thread_closed",
-                user=self.bot.get_user(thread_data.get("user_id")) if thread_data.get("user_id") else None,
+                user=user,
                 moderator=closer,
                 reason=reason or "No reason provided"
-            )
+            ))
             
             # Trigger extension hooks
             thread_data["closed_by"] = closer.id
             thread_data["close_reason"] = reason
-            await self._trigger_hook("thread_closed", thread_data, reason)
+            self._create_background_task(self._trigger_hook("thread_closed", thread_data, reason))
             
         except Exception as e:
             log.exception(f"Error closing thread: {e}")
             await channel.send("An error occurred while closing the thread.")
             
+    async def _delete_closed_channel(self, channel: discord.TextChannel, closer: discord.Member):
+        """Delete a closed thread channel and drop its channel index entry"""
+        try:
+            await channel.delete(reason=f"Modmail thread closed by {closer}")
+        except discord.HTTPException as e:
+            log.error(f"Failed to delete closed modmail channel {channel.id}: {e}")
+            return
+            
+        await self.config.custom("ChannelThread", channel.guild.id, channel.id).clear()
+        self._channel_threads.pop(channel.id, None)
+        
     @modmail.command(name="reply", aliases=["r"])
     @checks.mod_or_permissions(manage_messages=True)
     async def modmail_reply(self, ctx, *, message: str):
         """Reply to the user in this modmail thread"""
-        if not await self._is_modmail_channel(ctx.channel):
+        if not self._is_modmail_channel(ctx.channel):
             await ctx.send("This command can only be used in modmail threads.")
             return
             
@@ -1018,8 +1319,8 @@ class ModMail(commands.Cog):
         # Confirm in thread
         embed = discord.Embed(
             description=f"📤 Reply sent to {user.mention}",
-            color=0x00ff00,
-            timestamp=datetime.utcnow()
+            color=_COLOR_OK,
+            timestamp=datetime.now(timezone.utc)
         )
         await ctx.send(embed=embed)
         
@@ -1031,20 +1332,22 @@ class ModMail(commands.Cog):
             
     async def _send_reply_to_user(self, user: discord.User, staff_member: discord.Member, message: str, guild: discord.Guild):
         """Send staff reply to user"""
-        config = await self.config.guild(guild).all()
+        config = await self._get_guild_cfg(guild.id)
         
         embed = discord.Embed(
             description=message,
-            color=0x00ff00,
-            timestamp=datetime.utcnow()
+            color=_COLOR_OK,
+            timestamp=datetime.now(timezone.utc)
         )
         
-        # Anonymous staff setting
+        # Anonymous staff setting; only the icon URL actually shown is built
         if config.get("anonymous_staff", False):
-            embed.set_author(name=f"Staff - {guild.name}", icon_url=guild.icon.url if guild.icon else None)
+            author_name = f"Staff - {guild.name}"
+            author_icon_url = guild.icon.url if guild.icon else None
         else:
-            embed.set_author(name=f"{staff_member.display_name} - {guild.name}", icon_url=staff_member.display_avatar.url)
-            
+            author_name = f"{staff_member.display_name} - {guild.name}"
+            author_icon_url = staff_member.display_avatar.url
+        embed.set_author(name=author_name, icon_url=author_icon_url)
         embed.set_footer(text="You can reply to this message to continue the conversation.")
         
         try:
@@ -1058,7 +1361,7 @@ class ModMail(commands.Cog):
     @checks.mod_or_permissions(manage_messages=True)
     async def modmail_areply(self, ctx, *, message: str):
         """Send an anonymous reply to the user"""
-        if not await self._is_modmail_channel(ctx.channel):
+        if not self._is_modmail_channel(ctx.channel):
             await ctx.send("This command can only be used in modmail threads.")
             return
             
@@ -1073,12 +1376,14 @@ class ModMail(commands.Cog):
             return
             
         # Send anonymous reply
+        now = datetime.now(timezone.utc)
         embed = discord.Embed(
             description=message,
-            color=0x00ff00,
-            timestamp=datetime.utcnow()
+            color=_COLOR_OK,
+            timestamp=now
         )
-        embed.set_author(name=f"Staff - {ctx.guild.name}", icon_url=ctx.guild.icon.url if ctx.guild.icon else None)
+        guild_icon_url = ctx.guild.icon.url if ctx.guild.icon else None
+        embed.set_author(name=f"Staff - {ctx.guild.name}", icon_url=guild_icon_url)
         embed.set_footer(text="You can reply to this message to continue the conversation.")
         
         try:
@@ -1087,8 +1392,8 @@ class ModMail(commands.Cog):
             # Confirm in thread
             confirm_embed = discord.Embed(
                 description=f"📤 Anonymous reply sent to {user.mention}",
-                color=0x00ff00,
-                timestamp=datetime.utcnow()
+                color=_COLOR_OK,
+                timestamp=now
             )
             await ctx.send(embed=confirm_embed)
             
@@ -1107,13 +1412,13 @@ class ModMail(commands.Cog):
     async def modmail_snippet(self, ctx):
         """Snippet management commands"""
         if ctx.invoked_subcommand is None:
-            snippets = await self.config.guild(ctx.guild).snippets()
+            snippets = await self.config.custom("Snippet", ctx.guild.id).all()
             
             if not snippets:
                 await ctx.send("No snippets configured for this server.")
                 return
                 
-            embed = discord.Embed(title="Available Snippets", color=0x3498db)
+            embed = discord.Embed(title="Available Snippets", color=_COLOR_INFO)
             
             for name, data in snippets.items():
                 usage_count = data.get("usage_count", 0)
@@ -1129,13 +1434,12 @@ class ModMail(commands.Cog):
     @checks.mod_or_permissions(manage_messages=True)
     async def snippet_add(self, ctx, name: str, *, content: str):
         """Add a new snippet"""
-        async with self.config.guild(ctx.guild).snippets() as snippets:
-            snippets[name] = {
-                "content": content,
-                "created_by": ctx.author.id,
-                "created_at": datetime.utcnow().isoformat(),
-                "usage_count": 0
-            }
+        await self.config.custom("Snippet", ctx.guild.id, name).set({
+            "content": content,
+            "created_by": ctx.author.id,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "usage_count": 0
+        })
             
         await ctx.send(f"✅ Snippet `{name}` added successfully.")
         
@@ -1143,29 +1447,29 @@ class ModMail(commands.Cog):
     @checks.mod_or_permissions(manage_messages=True)
     async def snippet_remove(self, ctx, name: str):
         """Remove a snippet"""
-        async with self.config.guild(ctx.guild).snippets() as snippets:
-            if name in snippets:
-                del snippets[name]
-                await ctx.send(f"✅ Snippet `{name}` removed.")
-            else:
-                await ctx.send(f"❌ Snippet `{name}` not found.")
+        snippet = self.config.custom("Snippet", ctx.guild.id, name)
+        if await snippet.content():
+            await snippet.clear()
+            await ctx.send(f"✅ Snippet `{name}` removed.")
+        else:
+            await ctx.send(f"❌ Snippet `{name}` not found.")
                 
     @modmail_snippet.command(name="use")
     @checks.mod_or_permissions(manage_messages=True)
     async def snippet_use(self, ctx, name: str):
         """Use a snippet as a reply"""
-        if not await self._is_modmail_channel(ctx.channel):
+        if not self._is_modmail_channel(ctx.channel):
             await ctx.send("This command can only be used in modmail threads.")
             return
             
-        snippets = await self.config.guild(ctx.guild).snippets()
+        snippet = self.config.custom("Snippet", ctx.guild.id, name)
+        snippet_data = await snippet.all()
         
-        if name not in snippets:
+        if not snippet_data["content"]:
             await ctx.send(f"❌ Snippet `{name}` not found.")
             return
             
         # Get snippet content
-        snippet_data = snippets[name]
         content = snippet_data["content"]
         
         # Variable substitution
@@ -1173,17 +1477,19 @@ class ModMail(commands.Cog):
         if thread_data:
             user = self.bot.get_user(thread_data.get("user_id"))
             if user:
-                content = content.replace("{user}", user.mention)
-                content = content.replace("{username}", user.name)
-                content = content.replace("{server}", ctx.guild.name)
-                content = content.replace("{staff}", ctx.author.mention)
+                variables = {
+                    "user": user.mention,
+                    "username": user.name,
+                    "server": ctx.guild.name,
+                    "staff": ctx.author.mention
+                }
+                content = self._SNIPPET_VAR_RE.sub(lambda m: variables[m.group(1)], content)
                 
         # Send as reply
         await self.modmail_reply(ctx, message=content)
         
         # Track usage
-        async with self.config.guild(ctx.guild).snippets() as snippets:
-            snippets[name]["usage_count"] += 1
+        await snippet.usage_count.set(snippet_data["usage_count"] + 1)
             
         # Trigger hook
         await self._trigger_hook("snippet_used", {
@@ -1198,39 +1504,47 @@ class ModMail(commands.Cog):
     @checks.mod_or_permissions(manage_messages=True)
     async def modmail_block(self, ctx, user: discord.User, *, reason: str = None):
         """Block a user from using modmail"""
-        await self.config.user(user).blocked.set(True)
-        await self.config.user(user).block_reason.set(reason)
-        await self.config.user(user).blocked_at.set(datetime.utcnow().isoformat())
-        await self.config.user(user).blocked_by.set(ctx.author.id)
+        now = datetime.now(timezone.utc)
+        async with self.config.user(user).all() as user_data:
+            user_data.update({
+                "blocked": True,
+                "block_reason": reason,
+                "blocked_at": now.isoformat(),
+                "blocked_by": ctx.author.id
+            })
         
         # Also add to guild blocklist
-        async with self.config.guild(ctx.guild).blocked_users() as blocked:
-            if user.id not in blocked:
+        guild_blocks = self._guild_blocks.setdefault(ctx.guild.id, set())
+        if user.id not in guild_blocks:
+            guild_blocks.add(user.id)
+            async with self.config.guild(ctx.guild).blocked_users() as blocked:
                 blocked.append(user.id)
+            self._mark_guild_dirty(ctx.guild.id)
+        self._user_blocks.add(user.id)
                 
         # Log to modlog
-        await modlog.create_case(
+        self._create_background_task(modlog.create_case(
             self.bot,
             ctx.guild,
-            datetime.utcnow(),
+            now,
             action_type="modmail_user_blocked",
             user=user,
             moderator=ctx.author,
             reason=reason or "No reason provided"
-        )
+        ))
         
         # Trigger hook
-        await self._trigger_hook("user_blocked", {
+        self._create_background_task(self._trigger_hook("user_blocked", {
             "user_id": user.id,
             "blocked_by": ctx.author.id,
             "guild_id": ctx.guild.id,
             "reason": reason
-        })
+        }))
         
         embed = discord.Embed(
             title="User Blocked",
             description=f"{user.mention} has been blocked from using modmail.",
-            color=0xff6b6b
+            color=_COLOR_ERR
         )
         
         if reason:
@@ -1248,11 +1562,15 @@ class ModMail(commands.Cog):
             await ctx.send("No users are currently blocked.")
             return
             
-        embed = discord.Embed(title="Blocked Users", color=0xff6b6b)
+        embed = discord.Embed(title="Blocked Users", color=_COLOR_ERR)
         
-        for user_id in blocked_users[:10]:  # Limit to 10 for embed space
-            user = self.bot.get_user(user_id)
-            user_data = await self.config.user_from_id(user_id).all()
+        shown = blocked_users[:10]  # Limit to 10 for embed space
+        all_user_data = await asyncio.gather(*(self.config.user_from_id(user_id).all() for user_id in shown))
+        
+        users = {user_id: self.bot.get_user(user_id) for user_id in shown}
+        
+        for user_id, user_data in zip(shown, all_user_data):
+            user = users[user_id]
             
             user_str = f"{user} ({user_id})" if user else f"Unknown User ({user_id})"
             reason = user_data.get("block_reason", "No reason")
@@ -1268,15 +1586,23 @@ class ModMail(commands.Cog):
     @checks.mod_or_permissions(manage_messages=True)
     async def modmail_unblock(self, ctx, user: discord.User):
         """Unblock a user from modmail"""
-        await self.config.user(user).blocked.set(False)
-        await self.config.user(user).block_reason.clear()
-        await self.config.user(user).blocked_at.clear()
-        await self.config.user(user).blocked_by.clear()
+        async with self.config.user(user).all() as user_data:
+            user_data.update({
+                "blocked": False,
+                "block_reason": None,
+                "blocked_at": None,
+                "blocked_by": None
+            })
         
         # Remove from guild blocklist
-        async with self.config.guild(ctx.guild).blocked_users() as blocked:
-            if user.id in blocked:
-                blocked.remove(user.id)
+        guild_blocks = self._guild_blocks.get(ctx.guild.id, set())
+        if user.id in guild_blocks:
+            guild_blocks.discard(user.id)
+            async with self.config.guild(ctx.guild).blocked_users() as blocked:
+                if user.id in blocked:
+                    blocked.remove(user.id)
+            self._mark_guild_dirty(ctx.guild.id)
+        self._user_blocks.discard(user.id)
                 
         await ctx.send(f"✅ {user.mention} has been unblocked from modmail.")
         
@@ -1286,11 +1612,10 @@ class ModMail(commands.Cog):
     async def modmail_info(self, ctx, user: discord.User = None):
         """Get information about a user's modmail history"""
         if not user:
-            # Try to get user from current thread
-            if await self._is_modmail_channel(ctx.channel):
-                thread_data = await self._get_thread_data_from_channel(ctx.channel)
-                if thread_data:
-                    user = self.bot.get_user(thread_data.get("user_id"))
+            # Try to get user from current thread, including closed/archived ones
+            thread_data = await self._get_thread_data_from_channel(ctx.channel)
+            if thread_data:
+                user = self.bot.get_user(thread_data.get("user_id"))
                     
         if not user:
             await ctx.send("Please specify a user or use this command in a modmail thread.")
@@ -1298,7 +1623,7 @@ class ModMail(commands.Cog):
             
         user_data = await self.config.user(user).all()
         
-        embed = discord.Embed(title=f"Modmail Info - {user}", color=0x3498db)
+        embed = discord.Embed(title=f"Modmail Info - {user}", color=_COLOR_INFO)
         embed.set_thumbnail(url=user.display_avatar.url)
         
         # Basic info
@@ -1309,8 +1634,7 @@ class ModMail(commands.Cog):
         embed.add_field(name="Total Threads", value=user_data.get("total_threads", 0), inline=True)
         
         if user_data.get("last_thread_at"):
-            last_thread = datetime.fromisoformat(user_data["last_thread_at"])
-            embed.add_field(name="Last Thread", value=f"<t:{int(last_thread.timestamp())}:R>", inline=True)
+            embed.add_field(name="Last Thread", value=f"<t:{_iso_to_ts(user_data['last_thread_at'])}:R>", inline=True)
             
         # Block status
         if user_data.get("blocked", False):
@@ -1327,10 +1651,11 @@ class ModMail(commands.Cog):
             
         # Notes
         notes = user_data.get("notes", [])
-        if notes:
-            note_text = "\n".join([f"• {note}" for note in notes[-3:]])  # Show last 3 notes
-            if len(notes) > 3:
-                note_text += f"\n*... and {len(notes) - 3} more notes*"
+        note_count = len(notes)
+        if note_count:
+            note_text = "\n".join(f"• {note}" for note in notes[-3:])  # Show last 3 notes
+            if note_count > 3:
+                note_text += f"\n*... and {note_count - 3} more notes*"
             embed.add_field(name="Notes", value=note_text, inline=False)
             
         await ctx.send(embed=embed)
@@ -1340,10 +1665,9 @@ class ModMail(commands.Cog):
     async def modmail_logs(self, ctx, user: discord.User = None):
         """View modmail thread logs for a user"""
         if not user:
-            if await self._is_modmail_channel(ctx.channel):
-                thread_data = await self._get_thread_data_from_channel(ctx.channel)
-                if thread_data:
-                    user = self.bot.get_user(thread_data.get("user_id"))
+            thread_data = await self._get_thread_data_from_channel(ctx.channel)
+            if thread_data:
+                user = self.bot.get_user(thread_data.get("user_id"))
                     
         if not user:
             await ctx.send("Please specify a user or use this command in a modmail thread.")
@@ -1356,20 +1680,21 @@ class ModMail(commands.Cog):
             await ctx.send(f"{user.mention} has no modmail history in this server.")
             return
             
-        embed = discord.Embed(title=f"Modmail History - {user}", color=0x3498db)
+        embed = discord.Embed(title=f"Modmail History - {user}", color=_COLOR_INFO)
         
-        for thread_id in conversations[-5:]:  # Show last 5 threads
-            thread_data = await self.config.custom("Thread", ctx.guild.id, thread_id).all()
-            
-            if thread_data:
-                created_at = datetime.fromisoformat(thread_data["created_at"])
+        recent = conversations[-5:]  # Show last 5 threads
+        all_thread_data = await asyncio.gather(*(self.config.custom("Thread", ctx.guild.id, thread_id).all() for thread_id in recent))
+        
+        for thread_id, thread_data in zip(recent, all_thread_data):
+            if thread_data.get("created_at"):
+                created_at_ts = thread_data.get("created_at_ts") or _iso_to_ts(thread_data["created_at"])
                 status = thread_data.get("status", "unknown")
                 
-                value = f"Status: {status.title()}\nCreated: <t:{int(created_at.timestamp())}:R>"
+                value = f"Status: {status.title()}\nCreated: <t:{created_at_ts}:R>"
                 
                 if thread_data.get("closed_at"):
-                    closed_at = datetime.fromisoformat(thread_data["closed_at"])
-                    value += f"\nClosed: <t:{int(closed_at.timestamp())}:R>"
+                    closed_at_ts = thread_data.get("closed_at_ts") or _iso_to_ts(thread_data["closed_at"])
+                    value += f"\nClosed: <t:{closed_at_ts}:R>"
                     
                 if thread_data.get("close_reason"):
                     value += f"\nReason: {thread_data['close_reason']}"
@@ -1393,37 +1718,60 @@ class ModMail(commands.Cog):
             
     async def _auto_close_threads(self):
         """Auto-close inactive threads"""
-        for guild in self.bot.guilds:
-            config = await self.config.guild(guild).all()
+        guild_ids = list(self._enabled_guilds)
+        await self._prime_guild_cfgs(guild_ids)
+        
+        guilds = [guild for guild in map(self.bot.get_guild, guild_ids) if guild]
+        semaphore = asyncio.Semaphore(8)  # Bound concurrent closes to respect Discord rate limits
+        
+        results = await asyncio.gather(*(self._auto_close_guild(guild, semaphore) for guild in guilds), return_exceptions=True)
+        for guild, result in zip(guilds, results):
+            if isinstance(result, Exception):
+                log.error(f"Error auto-closing threads in guild {guild.id}: {result}")
+                
+    async def _auto_close_guild(self, guild: discord.Guild, semaphore: asyncio.Semaphore):
+        """Auto-close inactive threads in a single guild"""
+        config = await self._get_guild_cfg(guild.id)
+        
+        if not config.get("enabled", False):
+            return
             
-            if not config.get("enabled", False):
+        auto_close_time = config.get("thread_settings", {}).get("auto_close_after", 0)
+        if auto_close_time <= 0:
+            return
+            
+        # Find threads to close
+        all_threads = await self.config.custom("Thread", guild.id).all()
+        cutoff_ts = int(time.time()) - auto_close_time
+        closes = []
+        
+        for thread_id, thread_data in all_threads.items():
+            if thread_data.get("status") != "open":
                 continue
                 
-            auto_close_time = config.get("thread_settings", {}).get("auto_close_after", 0)
-            if auto_close_time <= 0:
+            # Skip placeholder records with no channel or creation time
+            if not thread_data.get("channel_id") or not (thread_data.get("created_at_ts") or thread_data.get("created_at")):
                 continue
                 
-            # Find threads to close
-            all_threads = await self.config.custom("Thread", guild.id).all()
-            cutoff_time = datetime.utcnow() - timedelta(seconds=auto_close_time)
-            
-            for thread_id, thread_data in all_threads.items():
-                if thread_data.get("status") != "open":
-                    continue
+            # Check last activity (simplified - could track actual last message)
+            created_at_ts = thread_data.get("created_at_ts") or _iso_to_ts(thread_data["created_at"])
+            if created_at_ts < cutoff_ts:
+                channel = guild.get_channel(thread_data.get("channel_id"))
+                if channel:
+                    closes.append(self._auto_close_thread(channel, thread_data, semaphore))
                     
-                # Check last activity (simplified - could track actual last message)
-                created_at = datetime.fromisoformat(thread_data["created_at"])
-                if created_at < cutoff_time:
-                    channel = guild.get_channel(thread_data.get("channel_id"))
-                    if channel:
-                        # Close the thread
-                        await self._close_thread(
-                            channel,
-                            guild.me,
-                            "Auto-closed due to inactivity",
-                            thread_data
-                        )
-                        
+        await asyncio.gather(*closes)
+        
+    async def _auto_close_thread(self, channel: discord.TextChannel, thread_data: dict, semaphore: asyncio.Semaphore):
+        """Close an inactive thread under the auto-close concurrency limit"""
+        async with semaphore:
+            await self._close_thread(
+                channel,
+                channel.guild.me,
+                "Auto-closed due to inactivity",
+                thread_data
+            )
+            
     async def _cleanup_old_data(self):
         """Clean up old data"""
         # This could include: